@@ -0,0 +1,32 @@
+"""Add product popularity index
+
+Revision ID: b7d3e1f4a2c9
+Revises: 9ff80080f0c4
+Create Date: 2026-10-17 10:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'b7d3e1f4a2c9'
+down_revision: Union[str, None] = '9ff80080f0c4'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Index the popularity sort so it can read rows in order"""
+    op.create_index(
+        'idx_products_tenant_popularity',
+        'products',
+        ['tenant_id', sa.text('purchase_count DESC'), sa.text('view_count DESC')],
+    )
+
+
+def downgrade() -> None:
+    """Drop the popularity index"""
+    op.drop_index('idx_products_tenant_popularity', table_name='products')
@@ -4,8 +4,6 @@ Supporting Stripe, PayPal, Apple Pay, Mada (Saudi debit), and STC Pay
 ZATCA compliant invoicing with B2B focus
 """
 
-import hashlib
-import hmac
 import json
 import logging
 import urllib.parse
@@ -14,6 +12,7 @@ from typing import Any, Dict, List, Optional
 from uuid import UUID
 
 import httpx
+import orjson
 import stripe
 from fastapi import APIRouter, BackgroundTasks, Depends, HTTPException, Request
 from sqlalchemy import and_, select
@@ -37,8 +36,10 @@ from app.schemas.payments import (
     STCPaymentCreate,
     StripeProductCreate,
 )
+from app.services.http_pool import get_http_client
 from app.services.notifications import NotificationService
 from app.services.payment_providers import MadaService, STCPayService, StripeService
+from app.services.webhook_signatures import verify_mada_signature, verify_stc_signature
 from app.services.zatca_service import ZATCAService
 
 logger = logging.getLogger(__name__)
@@ -382,17 +383,17 @@ async def create_paypal_order(
             },
         }
 
-        async with httpx.AsyncClient() as client:
-            response = await client.post(
-                f"{settings.PAYPAL_BASE_URL}/v2/checkout/orders",
-                headers={
-                    "Authorization": f"Bearer {access_token}",
-                    "Content-Type": "application/json",
-                },
-                json=paypal_order_data,
-            )
-            response.raise_for_status()
-            paypal_response = response.json()
+        client = get_http_client()
+        response = await client.post(
+            f"{settings.PAYPAL_BASE_URL}/v2/checkout/orders",
+            headers={
+                "Authorization": f"Bearer {access_token}",
+                "Content-Type": "application/json",
+            },
+            json=paypal_order_data,
+        )
+        response.raise_for_status()
+        paypal_response = response.json()
 
         # Save payment record
         payment = Payment(
@@ -436,16 +437,16 @@ async def capture_paypal_payment(order_id: str, db: AsyncSession = Depends(get_d
     try:
         access_token = await get_paypal_access_token()
 
-        async with httpx.AsyncClient() as client:
-            response = await client.post(
-                f"{settings.PAYPAL_BASE_URL}/v2/checkout/orders/{order_id}/capture",
-                headers={
-                    "Authorization": f"Bearer {access_token}",
-                    "Content-Type": "application/json",
-                },
-            )
-            response.raise_for_status()
-            capture_response = response.json()
+        client = get_http_client()
+        response = await client.post(
+            f"{settings.PAYPAL_BASE_URL}/v2/checkout/orders/{order_id}/capture",
+            headers={
+                "Authorization": f"Bearer {access_token}",
+                "Content-Type": "application/json",
+            },
+        )
+        response.raise_for_status()
+        capture_response = response.json()
 
         # Update payment status
         payment_query = select(Payment).where(Payment.provider_payment_id == order_id)
@@ -743,15 +744,15 @@ async def create_stripe_payment_link(
 async def get_paypal_access_token() -> str:
     """Get PayPal access token"""
     try:
-        async with httpx.AsyncClient() as client:
-            response = await client.post(
-                f"{settings.PAYPAL_BASE_URL}/v1/oauth2/token",
-                auth=(settings.PAYPAL_CLIENT_ID, settings.PAYPAL_SECRET),
-                headers={"Accept": "application/json"},
-                data={"grant_type": "client_credentials"},
-            )
-            response.raise_for_status()
-            return response.json()["access_token"]
+        client = get_http_client()
+        response = await client.post(
+            f"{settings.PAYPAL_BASE_URL}/v1/oauth2/token",
+            auth=(settings.PAYPAL_CLIENT_ID, settings.PAYPAL_SECRET),
+            headers={"Accept": "application/json"},
+            data={"grant_type": "client_credentials"},
+        )
+        response.raise_for_status()
+        return response.json()["access_token"]
     except Exception as e:
         logger.error(f"Failed to get PayPal token: {e}")
         raise HTTPException(status_code=500, detail="PayPal authentication failed")
@@ -805,7 +806,6 @@ async def stripe_webhook(
 
 @router.post("/webhooks/mada")
 async def mada_webhook(
-    webhook_data: Dict[str, Any],
     request: Request,
     background_tasks: BackgroundTasks,
     db: AsyncSession = Depends(get_db),
@@ -813,11 +813,14 @@ async def mada_webhook(
     """Handle Mada payment webhooks"""
 
     try:
-        # Verify webhook signature (implement Mada-specific verification)
+        # Verify webhook signature over the raw body exactly as Mada sent it
+        payload = await request.body()
         signature = request.headers.get("x-mada-signature")
-        if not verify_mada_signature(webhook_data, signature):
+        if not verify_mada_signature(payload, signature):
             raise HTTPException(status_code=401, detail="Invalid signature")
 
+        webhook_data = orjson.loads(payload)
+
         # Handle payment status updates
         if webhook_data["status"] == "completed":
             await handle_payment_success(
@@ -845,7 +848,6 @@ async def mada_webhook(
 
 @router.post("/webhooks/stc-pay")
 async def stc_pay_webhook(
-    webhook_data: Dict[str, Any],
     request: Request,
     background_tasks: BackgroundTasks,
     db: AsyncSession = Depends(get_db),
@@ -853,11 +855,14 @@ async def stc_pay_webhook(
     """Handle STC Pay webhooks"""
 
     try:
-        # Verify webhook signature
+        # Verify webhook signature over the raw body exactly as STC Pay sent it
+        payload = await request.body()
         signature = request.headers.get("x-stc-signature")
-        if not verify_stc_signature(webhook_data, signature):
+        if not verify_stc_signature(payload, signature):
             raise HTTPException(status_code=401, detail="Invalid signature")
 
+        webhook_data = orjson.loads(payload)
+
         # Handle payment status updates
         if webhook_data["status"] == "paid":
             await handle_payment_success(
@@ -893,7 +898,7 @@ async def paypal_webhook(
 
     try:
         payload = await request.body()
-        webhook_data = json.loads(payload.decode())
+        webhook_data = orjson.loads(payload)
 
         # Verify webhook signature (PayPal specific verification)
         auth_header = request.headers.get("PAYPAL-AUTH-ALGO")
@@ -1054,30 +1059,6 @@ async def handle_payment_failure(
         await db.rollback()
 
 
-def verify_mada_signature(payload: Dict[str, Any], signature: str) -> bool:
-    """Verify Mada webhook signature"""
-    # Implementation depends on Mada's specific signature scheme
-    expected_signature = hmac.new(
-        settings.MADA_WEBHOOK_SECRET.encode(),
-        json.dumps(payload, sort_keys=True).encode(),
-        hashlib.sha256,
-    ).hexdigest()
-
-    return hmac.compare_digest(signature, expected_signature)
-
-
-def verify_stc_signature(payload: Dict[str, Any], signature: str) -> bool:
-    """Verify STC Pay webhook signature"""
-    # Implementation depends on STC Pay's specific signature scheme
-    expected_signature = hmac.new(
-        settings.STC_PAY_WEBHOOK_SECRET.encode(),
-        json.dumps(payload, sort_keys=True).encode(),
-        hashlib.sha256,
-    ).hexdigest()
-
-    return hmac.compare_digest(signature, expected_signature)
-
-
 async def generate_zatca_invoice(order_id: UUID, payment_id: UUID):
     """Generate ZATCA compliant invoice"""
     try:
@@ -48,6 +48,7 @@ from app.schemas.products import (
     ProductVariantResponse,
     ProductVariantUpdate,
 )
+from app.services.view_counter import record_product_view
 
 router = APIRouter()
 
@@ -503,9 +504,8 @@ async def get_product(
                 status_code=status.HTTP_404_NOT_FOUND, detail="Product not found"
             )
 
-    # Increment view count (don't await to not block response)
-    product.view_count += 1
-    await db.commit()
+    # Buffer the view in Redis; the counter is written back in batches
+    await record_product_view(product.id)
 
     return ProductResponse.from_orm(product)
 
@@ -5,7 +5,8 @@ Enhanced caching system with multiple strategies and performance monitoring
 import json
 import hashlib
 import time
-from typing import Any, Dict, List, Optional, Union
+from collections import OrderedDict
+from typing import Any, Dict, Hashable, List, Optional, Tuple, Union
 from functools import wraps
 import redis.asyncio as redis
 from app.core.config import settings
@@ -41,6 +42,16 @@ class CacheManager:
             logger.error(f"Cache set error for key {key}: {e}")
             return False
     
+    async def set_if_absent(self, key: str, ttl: Optional[int] = None) -> bool:
+        """Atomically claim a key; returns False if it was already set"""
+        try:
+            ttl = ttl or self.default_ttl
+            return bool(await self.redis_client.set(key, 1, ex=ttl, nx=True))
+        except Exception as e:
+            logger.error(f"Cache set_if_absent error for key {key}: {e}")
+            # Fail open so callers still process the work when Redis is down
+            return True
+    
     async def delete(self, pattern: str) -> bool:
         """Delete cache keys by pattern"""
         try:
@@ -116,6 +127,39 @@ class CacheManager:
 # Global cache manager instance
 cache_manager = CacheManager()
 
+
+class VerifiedSignatureCache:
+    """Bounded in-process LRU of webhook signatures that verified successfully
+
+    Each entry carries its own wall-clock expiry so callers can tie it to the
+    timestamp a provider signed.
+    """
+
+    def __init__(self, maxsize: int = 4096):
+        self.maxsize = maxsize
+        self._entries: "OrderedDict[Tuple[Hashable, ...], float]" = OrderedDict()
+
+    @staticmethod
+    def make_key(payload: bytes, *parts: Hashable) -> Tuple[Hashable, ...]:
+        """Build a compact key without holding on to the raw payload"""
+        return (*parts, hashlib.blake2b(payload, digest_size=16).digest())
+
+    def __contains__(self, key: Tuple[Hashable, ...]) -> bool:
+        expires_at = self._entries.get(key)
+        if expires_at is None:
+            return False
+        if time.time() >= expires_at:
+            del self._entries[key]
+            return False
+        return True
+
+    def add(self, key: Tuple[Hashable, ...], expires_at: float) -> None:
+        """Remember a successful verification until ``expires_at``"""
+        self._entries[key] = expires_at
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+
 def cache_result(prefix: str, ttl: Optional[int] = None, key_func=None):
     """Decorator for caching function results"""
     def decorator(func):
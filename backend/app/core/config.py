@@ -22,6 +22,7 @@ class Settings(BaseSettings):
     ALGORITHM: str = "HS256"
     ACCESS_TOKEN_EXPIRE_MINUTES: int = 30
     REFRESH_TOKEN_EXPIRE_DAYS: int = 30
+    FRONTEND_URL: str = "http://localhost:3000"
 
     # Database
     DATABASE_URL: str = (
@@ -80,11 +81,17 @@ class Settings(BaseSettings):
     MADA_MERCHANT_ID: Optional[str] = None
     MADA_API_KEY: Optional[str] = None
     MADA_ENDPOINT: str = "https://api.mada.sa"
+    MADA_WEBHOOK_SECRET: Optional[str] = None
 
     # STC Pay (Saudi Arabia)
     STC_PAY_MERCHANT_ID: Optional[str] = None
     STC_PAY_API_KEY: Optional[str] = None
     STC_PAY_ENDPOINT: str = "https://api.stcpay.com.sa"
+    STC_PAY_WEBHOOK_SECRET: Optional[str] = None
+
+    # Moyasar (Saudi Arabia)
+    MOYASAR_PUBLISHABLE_KEY: Optional[str] = None
+    MOYASAR_SECRET_KEY: Optional[str] = None
 
     # ZATCA (Saudi Tax Authority)
     ZATCA_ENABLED: bool = False
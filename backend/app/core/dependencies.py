@@ -3,6 +3,7 @@ FastAPI Dependencies for authentication, authorization, and common functionality
 """
 
 import json
+import time
 from datetime import datetime, timedelta
 from typing import Any, Dict, Optional
 
@@ -24,6 +25,21 @@ security = HTTPBearer()
 # Redis connection
 redis_client = redis.from_url(settings.REDIS_URL, decode_responses=True)
 
+# Approximate sliding window: the previous bucket is weighted by how much of it
+# still overlaps the window, so only two counters are kept per identifier
+_SLIDING_WINDOW_SCRIPT = """
+local window = tonumber(ARGV[2])
+local current = tonumber(redis.call('GET', KEYS[1]) or '0')
+local previous = tonumber(redis.call('GET', KEYS[2]) or '0')
+local weight = (window - tonumber(ARGV[3])) / window
+if current + previous * weight >= tonumber(ARGV[1]) then
+    return 0
+end
+redis.call('INCR', KEYS[1])
+redis.call('EXPIRE', KEYS[1], window * 2)
+return 1
+"""
+
 
 class AuthenticationError(HTTPException):
     def __init__(self, detail: str = "Authentication failed"):
@@ -209,29 +225,32 @@ async def verify_rate_limit(
     if not identifier:
         identifier = getattr(request.state, "user_id", None) or request.client.host
 
-    key = f"rate_limit:{identifier}"
+    window = settings.RATE_LIMIT_WINDOW
+    now = time.time()
+    bucket = int(now // window)
 
     try:
-        # Get current count
-        current = await redis_client.get(key)
-        if current and int(current) >= settings.RATE_LIMIT_REQUESTS:
-            raise HTTPException(
-                status_code=status.HTTP_429_TOO_MANY_REQUESTS,
-                detail="Rate limit exceeded",
-            )
-
-        # Increment counter
-        pipeline = redis_client.pipeline()
-        pipeline.incr(key)
-        pipeline.expire(key, settings.RATE_LIMIT_WINDOW)
-        await pipeline.execute()
-
-        return True
-
-    except Exception as e:
+        allowed = await redis_client.eval(
+            _SLIDING_WINDOW_SCRIPT,
+            2,
+            f"rate_limit:{identifier}:{bucket}",
+            f"rate_limit:{identifier}:{bucket - 1}",
+            settings.RATE_LIMIT_REQUESTS,
+            window,
+            now - bucket * window,
+        )
+    except Exception:
         # If Redis is down, allow the request
         return True
 
+    if not allowed:
+        raise HTTPException(
+            status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+            detail="Rate limit exceeded",
+        )
+
+    return True
+
 
 async def get_cache(key: str) -> Optional[Dict[Any, Any]]:
     """Get data from Redis cache"""
@@ -3,8 +3,11 @@ BrainSAIT B2B Platform - Main FastAPI Application
 Multi-tenant SaaS with Arabic/English support
 """
 
+import asyncio
 import logging
+import queue
 from contextlib import asynccontextmanager
+from logging.handlers import QueueHandler, QueueListener
 
 from fastapi import Depends, FastAPI, Request
 from fastapi.middleware.cors import CORSMiddleware
@@ -35,9 +38,15 @@ from app.core.config import settings
 from app.core.database import close_db, init_db
 from app.core.localization import LocalizationMiddleware
 from app.core.tenant import TenantMiddleware
-
-# Configure logging
-logging.basicConfig(level=logging.INFO)
+from app.services.http_pool import close_http_client
+from app.services.payment_gateway import payment_gateway
+from app.services.view_counter import run_view_count_flusher
+
+# Configure logging; handlers run on a listener thread so that writing a
+# log record never blocks the event loop
+log_queue: "queue.SimpleQueue[logging.LogRecord]" = queue.SimpleQueue()
+log_listener = QueueListener(log_queue, logging.StreamHandler())
+logging.basicConfig(level=logging.INFO, handlers=[QueueHandler(log_queue)])
 logger = logging.getLogger(__name__)
 
 
@@ -45,16 +54,23 @@ logger = logging.getLogger(__name__)
 async def lifespan(app: FastAPI):
     """Handle startup and shutdown events"""
     # Startup
+    log_listener.start()
     logger.info("🚀 Starting BrainSAIT B2B Platform...")
     await init_db()
     logger.info("✅ Database connected")
+    view_count_flusher = asyncio.create_task(run_view_count_flusher())
 
     yield
 
     # Shutdown
     logger.info("🔄 Shutting down...")
+    view_count_flusher.cancel()
+    await asyncio.gather(view_count_flusher, return_exceptions=True)
+    await payment_gateway.aclose()
+    await close_http_client()
     await close_db()
     logger.info("👋 Goodbye!")
+    log_listener.stop()
 
 
 # Create FastAPI app
@@ -281,4 +297,6 @@ if __name__ == "__main__":
         port=8000,
         reload=settings.DEBUG,
         log_level="info",
+        loop="uvloop",
+        http="httptools",
     )
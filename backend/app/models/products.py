@@ -231,6 +231,12 @@ class Product(Base):
         Index("idx_products_status", "status"),
         Index("idx_products_featured", "is_featured"),
         Index("idx_products_barcode", "barcode"),
+        Index(
+            "idx_products_tenant_popularity",
+            "tenant_id",
+            purchase_count.desc(),
+            view_count.desc(),
+        ),
     )
 
     @property
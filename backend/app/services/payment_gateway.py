@@ -4,30 +4,222 @@ Supports Stripe, PayPal, Apple Pay with local Saudi gateways integration
 """
 
 import asyncio
+import base64
+import hashlib
+import logging
+import random
+import secrets
+import time
+from contextlib import asynccontextmanager
 from datetime import datetime, timedelta
-from decimal import Decimal
-from typing import Any, Dict, List, Optional
+from decimal import ROUND_HALF_UP, Decimal
+from typing import (
+    Any,
+    AsyncIterator,
+    Awaitable,
+    Callable,
+    Dict,
+    List,
+    Optional,
+    Tuple,
+)
 
 import httpx
+import orjson
 import stripe
 from fastapi import HTTPException, status
-from sqlalchemy.orm import Session
+from sqlalchemy import update
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import selectinload
 
+from app.core.cache import VerifiedSignatureCache, cache_manager
 from app.core.config import get_settings
-from app.models.orders import Order, OrderItem, OrderStatus, PaymentMethod
+from app.models.orders import Order, OrderItem, PaymentStatus
 from app.models.products import Product
 from app.models.users import User
 from app.schemas.payment import (
     ApplePayValidation,
+    PaymentMethod,
     PaymentRequest,
     PaymentResponse,
     PayPalPaymentCreate,
     StripeProductCreate,
     StripeSubscriptionCreate,
 )
+from app.services.http_pool import HTTP_TIMEOUT, get_http_client
 
+logger = logging.getLogger(__name__)
 settings = get_settings()
 
+# Refresh cached OAuth tokens this many seconds before they expire
+TOKEN_EXPIRY_MARGIN = 60
+
+# Maximum number of Stripe catalog writes in flight during a product sync
+STRIPE_SYNC_CONCURRENCY = 25
+
+# Retry policy for transient Stripe failures (rate limits, network, 5xx)
+STRIPE_MAX_RETRIES = 5
+STRIPE_RETRY_MAX_DELAY = 8.0
+STRIPE_RETRY_JITTER = 0.25
+
+# Client-side cap on Stripe API requests, kept below Stripe's live-mode limit
+STRIPE_REQUESTS_PER_SECOND = 80
+
+# How long processed webhook event IDs are remembered for de-duplication
+WEBHOOK_DEDUP_TTL = 24 * 60 * 60
+
+# Stripe's replay tolerance; cached verifications expire at the signed
+# timestamp plus this many seconds
+WEBHOOK_SIGNATURE_TOLERANCE = 300
+
+# Per-user, per-gateway limit on concurrent payment attempts. Slots that are
+# never released (e.g. a crashed worker) expire after PAYMENT_SLOT_TIMEOUT.
+MAX_INFLIGHT_PAYMENTS_PER_USER = 5
+PAYMENT_SLOT_TIMEOUT = 60
+
+_ACQUIRE_PAYMENT_SLOT_SCRIPT = """
+local now = tonumber(ARGV[2])
+local timeout = tonumber(ARGV[3])
+redis.call('ZREMRANGEBYSCORE', KEYS[1], '-inf', now - timeout)
+if redis.call('ZCARD', KEYS[1]) >= tonumber(ARGV[4]) then
+    return 0
+end
+redis.call('ZADD', KEYS[1], now, ARGV[1])
+redis.call('EXPIRE', KEYS[1], timeout)
+return 1
+"""
+
+# Fixed Stripe payment link options for B2B sales
+STRIPE_PAYMENT_LINK_OPTIONS: Dict[str, Any] = {
+    "allow_promotion_codes": True,
+    "billing_address_collection": "required",
+    "tax_id_collection": {"enabled": True},
+    "custom_fields": [
+        {
+            "key": "company_name",
+            "label": {"type": "text", "custom": "Company Name"},
+            "type": "text",
+            "optional": False,
+        },
+        {
+            "key": "vat_number",
+            "label": {
+                "type": "text",
+                "custom": "VAT Number (if applicable)",
+            },
+            "type": "text",
+            "optional": True,
+        },
+    ],
+    "after_completion": {
+        "type": "hosted_confirmation",
+        "hosted_confirmation": {
+            "custom_message": "Thank you for your purchase! You will receive download instructions via email."
+        },
+    },
+}
+
+# Fixed Stripe checkout session options
+STRIPE_CHECKOUT_OPTIONS: Dict[str, Any] = {
+    "payment_method_types": ["card"],
+    "mode": "payment",
+    "billing_address_collection": "required",
+    "tax_id_collection": {"enabled": True},
+    "allow_promotion_codes": True,
+    "automatic_tax": {"enabled": True},
+}
+
+# Fixed PayPal checkout experience settings
+PAYPAL_APPLICATION_CONTEXT: Dict[str, Any] = {
+    "brand_name": "BrainSAIT Solutions",
+    "landing_page": "BILLING",
+    "user_action": "PAY_NOW",
+    "return_url": f"{settings.FRONTEND_URL}/payment/success",
+    "cancel_url": f"{settings.FRONTEND_URL}/payment/cancel",
+}
+
+
+class _AsyncTokenBucket:
+    """Token bucket limiter shared by coroutines on one event loop"""
+
+    def __init__(self, rate: float, capacity: Optional[float] = None):
+        self.rate = rate
+        self.capacity = capacity or rate
+        self._tokens = self.capacity
+        self._updated_at = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    async def acquire(self) -> None:
+        """Wait until a token is available and take it"""
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                self._tokens = min(
+                    self.capacity, self._tokens + (now - self._updated_at) * self.rate
+                )
+                self._updated_at = now
+
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+
+                await asyncio.sleep((1 - self._tokens) / self.rate)
+
+
+def _to_minor_units(amount: Any) -> int:
+    """Convert a SAR amount to halalas, rounding half up without float error"""
+    return int((Decimal(str(amount)) * 100).to_integral_value(rounding=ROUND_HALF_UP))
+
+
+def _idempotency_key(prefix: str, params: Dict[str, Any]) -> str:
+    """Derive a Stripe idempotency key that changes whenever the request does"""
+    digest = hashlib.blake2b(
+        orjson.dumps(params, default=str, option=orjson.OPT_SORT_KEYS),
+        digest_size=16,
+    ).hexdigest()
+    return f"{prefix}-{digest}"
+
+
+def _stripe_signature_timestamp(sig_header: str) -> Optional[int]:
+    """Return the signed ``t=`` timestamp from a Stripe-Signature header"""
+    for item in sig_header.split(","):
+        key, _, value = item.strip().partition("=")
+        if key == "t":
+            try:
+                return int(value)
+            except ValueError:
+                return None
+    return None
+
+
+def _basic_auth_header(username: Optional[str], password: Optional[str] = "") -> str:
+    """Build an HTTP Basic Authorization header value"""
+    credentials = base64.b64encode(f"{username}:{password}".encode()).decode()
+    return f"Basic {credentials}"
+
+
+def _order_line_items(order: Order) -> Tuple[List[Dict[str, Any]], Decimal]:
+    """Flatten order items into gateway-neutral line items plus the order total"""
+    line_items = []
+    total = Decimal("0")
+
+    for item in order.items:
+        price = Decimal(str(item.price))
+        total += price * item.quantity
+        line_items.append(
+            {
+                "name": item.product_name,
+                "description": f"License: {item.license_type}",
+                "product_id": str(item.product_id),
+                "license_type": item.license_type,
+                "price": f"{price:.2f}",
+                "unit_amount": _to_minor_units(price),
+                "quantity": item.quantity,
+            }
+        )
+
+    return line_items, total
+
 
 class PaymentGatewayService:
     """Unified payment gateway service"""
@@ -36,46 +228,143 @@ class PaymentGatewayService:
         # Initialize Stripe
         stripe.api_key = settings.STRIPE_SECRET_KEY
         self.stripe = stripe
+        self._stripe_rate_limiter = _AsyncTokenBucket(STRIPE_REQUESTS_PER_SECOND)
 
         # PayPal configuration
         self.paypal_client_id = settings.PAYPAL_CLIENT_ID
         self.paypal_secret = settings.PAYPAL_SECRET
         self.paypal_base_url = settings.PAYPAL_BASE_URL
+        self._paypal_token_headers = {
+            "Accept": "application/json",
+            "Authorization": _basic_auth_header(
+                self.paypal_client_id, self.paypal_secret
+            ),
+        }
+        self._paypal_token: Optional[str] = None
+        self._paypal_token_expires_at = 0.0
+        self._paypal_token_lock = asyncio.Lock()
+
+        # Moyasar authenticates with the secret key as the Basic auth username
+        self._moyasar_auth_header = _basic_auth_header(settings.MOYASAR_SECRET_KEY)
 
         # Apple Pay configuration
         self.apple_pay_merchant_id = settings.APPLE_PAY_MERCHANT_ID
         self.apple_pay_domain = settings.APPLE_PAY_DOMAIN
 
+        # Mutual-TLS Apple Pay client (created lazily, closed on app shutdown)
+        self._apple_pay_client: Optional[httpx.AsyncClient] = None
+
+        # Successful Stripe verifications, so redeliveries skip the check
+        self._verified_signatures = VerifiedSignatureCache()
+
+        # Gateway dispatch tables. Entries look methods up on self at call time
+        # so they can be overridden per instance.
+        self._payment_processors: Dict[str, Callable[..., Awaitable[Any]]] = {
+            "stripe": lambda order, data: self._process_stripe_payment(order, data),
+            "paypal": lambda order, data: self.create_paypal_order(order),
+            "apple_pay": lambda order, data: self.process_apple_pay_payment(
+                data["payment_token"], order
+            ),
+            "moyasar": lambda order, data: self.create_moyasar_payment(order),
+            "hyperpay": lambda order, data: self.create_hyperpay_checkout(order),
+        }
+        self._webhook_handlers: Dict[str, Callable[..., Awaitable[Any]]] = {
+            "stripe": lambda event, db: self._handle_stripe_webhook(event, db),
+            "paypal": lambda event, db: self._handle_paypal_webhook(event, db),
+            "moyasar": lambda event, db: self._handle_moyasar_webhook(event, db),
+            "hyperpay": lambda event, db: self._handle_hyperpay_webhook(event, db),
+        }
+
+    # ==================== HTTP CLIENTS ====================
+
+    def _get_client(self) -> httpx.AsyncClient:
+        """Return the process-wide pooled HTTP client used for gateway API calls"""
+        return get_http_client()
+
+    def _get_apple_pay_client(self) -> httpx.AsyncClient:
+        """Return the mutual-TLS client used for Apple Pay merchant validation"""
+        if self._apple_pay_client is None or self._apple_pay_client.is_closed:
+            self._apple_pay_client = httpx.AsyncClient(
+                cert=(settings.APPLE_PAY_CERT_PATH, settings.APPLE_PAY_KEY_PATH),
+                verify=settings.APPLE_PAY_CA_PATH,
+                timeout=HTTP_TIMEOUT,
+            )
+        return self._apple_pay_client
+
+    async def aclose(self) -> None:
+        """Close the Apple Pay client; the shared pool is closed by http_pool"""
+        if self._apple_pay_client is not None and not self._apple_pay_client.is_closed:
+            await self._apple_pay_client.aclose()
+        self._apple_pay_client = None
+
     # ==================== STRIPE INTEGRATION ====================
 
+    async def _stripe_call(self, method: Callable[..., Any], **params: Any) -> Any:
+        """Call a Stripe SDK method, retrying transient failures with backoff
+
+        The Stripe SDK performs blocking HTTP requests, so each call runs in a
+        worker thread to keep the event loop free.
+        """
+        for attempt in range(STRIPE_MAX_RETRIES):
+            await self._stripe_rate_limiter.acquire()
+            try:
+                return await asyncio.to_thread(method, **params)
+            except (stripe.error.RateLimitError, stripe.error.APIConnectionError):
+                if attempt == STRIPE_MAX_RETRIES - 1:
+                    raise
+            except stripe.error.APIError as e:
+                if attempt == STRIPE_MAX_RETRIES - 1 or (
+                    e.http_status is not None and e.http_status < 500
+                ):
+                    raise
+
+            await asyncio.sleep(
+                min(2**attempt, STRIPE_RETRY_MAX_DELAY)
+                + random.random() * STRIPE_RETRY_JITTER
+            )
+
     async def create_stripe_product(
         self, product_data: Dict[str, Any]
     ) -> Dict[str, Any]:
         """Create product in Stripe catalog"""
         try:
             # Create product
-            stripe_product = self.stripe.Product.create(
-                name=product_data["name"],
-                description=product_data.get("description", ""),
-                metadata={
+            product_params = {
+                "name": product_data["name"],
+                "description": product_data.get("description", ""),
+                "metadata": {
                     "product_id": str(product_data["id"]),
                     "category": product_data.get("category", ""),
                     "source": "brainsait_store",
                 },
-                images=product_data.get("images", []),
-                url=product_data.get("live_demo", ""),
-                active=True,
+                "images": product_data.get("images", []),
+                "url": product_data.get("live_demo", ""),
+                "active": True,
+            }
+            stripe_product = await self._stripe_call(
+                self.stripe.Product.create,
+                **product_params,
+                idempotency_key=_idempotency_key(
+                    f"product-{product_data['id']}", product_params
+                ),
             )
 
             # Create price
-            stripe_price = self.stripe.Price.create(
-                product=stripe_product.id,
-                unit_amount=int(product_data["price"] * 100),  # Convert to cents
-                currency="sar",
-                metadata={
+            price_params = {
+                "product": stripe_product.id,
+                "unit_amount": _to_minor_units(product_data["price"]),
+                "currency": "sar",
+                "metadata": {
                     "pricing_type": product_data.get("pricing_type", "one_time"),
                     "includes_source": str(product_data.get("includes_source", False)),
                 },
+            }
+            stripe_price = await self._stripe_call(
+                self.stripe.Price.create,
+                **price_params,
+                idempotency_key=_idempotency_key(
+                    f"product-{product_data['id']}-price", price_params
+                ),
             )
 
             return {
@@ -86,9 +375,10 @@ class PaymentGatewayService:
             }
 
         except Exception as e:
+            logger.error(f"Failed to create Stripe product: {e}", exc_info=True)
             raise HTTPException(
                 status_code=status.HTTP_400_BAD_REQUEST,
-                detail=f"Failed to create Stripe product: {str(e)}",
+                detail="Failed to create Stripe product",
             )
 
     async def create_stripe_payment_link(
@@ -96,7 +386,8 @@ class PaymentGatewayService:
     ) -> str:
         """Create Stripe payment link for B2B sales"""
         try:
-            payment_link = self.stripe.PaymentLink.create(
+            payment_link = await self._stripe_call(
+                self.stripe.PaymentLink.create,
                 line_items=[
                     {
                         "price": price_id,
@@ -104,40 +395,16 @@ class PaymentGatewayService:
                     }
                 ],
                 metadata=metadata or {},
-                allow_promotion_codes=True,
-                billing_address_collection="required",
-                tax_id_collection={"enabled": True},
-                custom_fields=[
-                    {
-                        "key": "company_name",
-                        "label": {"type": "text", "custom": "Company Name"},
-                        "type": "text",
-                        "optional": False,
-                    },
-                    {
-                        "key": "vat_number",
-                        "label": {
-                            "type": "text",
-                            "custom": "VAT Number (if applicable)",
-                        },
-                        "type": "text",
-                        "optional": True,
-                    },
-                ],
-                after_completion={
-                    "type": "hosted_confirmation",
-                    "hosted_confirmation": {
-                        "custom_message": "Thank you for your purchase! You will receive download instructions via email."
-                    },
-                },
+                **STRIPE_PAYMENT_LINK_OPTIONS,
             )
 
             return payment_link.url
 
         except Exception as e:
+            logger.error(f"Failed to create payment link: {e}", exc_info=True)
             raise HTTPException(
                 status_code=status.HTTP_400_BAD_REQUEST,
-                detail=f"Failed to create payment link: {str(e)}",
+                detail="Failed to create payment link",
             )
 
     async def create_stripe_checkout_session(
@@ -145,31 +412,29 @@ class PaymentGatewayService:
     ) -> Dict[str, Any]:
         """Create Stripe checkout session for order"""
         try:
-            line_items = []
-
-            for item in order.items:
-                line_items.append(
-                    {
-                        "price_data": {
-                            "currency": "sar",
-                            "product_data": {
-                                "name": item.product_name,
-                                "description": f"License: {item.license_type}",
-                                "metadata": {
-                                    "product_id": str(item.product_id),
-                                    "license_type": item.license_type,
-                                },
+            order_items, _ = _order_line_items(order)
+            line_items = [
+                {
+                    "price_data": {
+                        "currency": "sar",
+                        "product_data": {
+                            "name": item["name"],
+                            "description": item["description"],
+                            "metadata": {
+                                "product_id": item["product_id"],
+                                "license_type": item["license_type"],
                             },
-                            "unit_amount": int(item.price * 100),
                         },
-                        "quantity": item.quantity,
-                    }
-                )
+                        "unit_amount": item["unit_amount"],
+                    },
+                    "quantity": item["quantity"],
+                }
+                for item in order_items
+            ]
 
-            session = self.stripe.checkout.Session.create(
-                payment_method_types=["card"],
+            session = await self._stripe_call(
+                self.stripe.checkout.Session.create,
                 line_items=line_items,
-                mode="payment",
                 success_url=success_url,
                 cancel_url=cancel_url,
                 metadata={
@@ -177,12 +442,12 @@ class PaymentGatewayService:
                     "user_id": str(order.user_id),
                     "tenant_id": str(order.tenant_id),
                 },
-                billing_address_collection="required",
-                tax_id_collection={"enabled": True},
-                allow_promotion_codes=True,
-                automatic_tax={"enabled": True},
                 customer_email=order.customer_email,
                 expires_at=int((datetime.utcnow() + timedelta(hours=24)).timestamp()),
+                # expires_at differs on every call, so each checkout attempt gets
+                # its own key; _stripe_call reuses it for its own retries
+                idempotency_key=f"order-{order.id}-checkout-{secrets.token_hex(8)}",
+                **STRIPE_CHECKOUT_OPTIONS,
             )
 
             return {
@@ -192,23 +457,23 @@ class PaymentGatewayService:
             }
 
         except Exception as e:
+            logger.error(f"Failed to create Stripe session: {e}", exc_info=True)
             raise HTTPException(
                 status_code=status.HTTP_400_BAD_REQUEST,
-                detail=f"Failed to create Stripe session: {str(e)}",
+                detail="Failed to create Stripe session",
             )
 
     async def sync_products_to_stripe(self, products: List[Product]) -> Dict[str, Any]:
         """Sync all products to Stripe catalog"""
-        synced_products = []
-        errors = []
+        semaphore = asyncio.Semaphore(STRIPE_SYNC_CONCURRENCY)
 
-        for product in products:
-            try:
+        async def sync_product(product: Product) -> Dict[str, Any]:
+            async with semaphore:
                 product_data = {
                     "id": product.id,
                     "name": product.name,
                     "description": product.description,
-                    "price": float(product.price),
+                    "price": product.price,
                     "category": product.category,
                     "images": [product.image_url] if product.image_url else [],
                     "live_demo": product.live_demo,
@@ -217,19 +482,23 @@ class PaymentGatewayService:
                 }
 
                 stripe_data = await self.create_stripe_product(product_data)
-                synced_products.append(
-                    {
-                        "product_id": product.id,
-                        "stripe_product_id": stripe_data["product_id"],
-                        "stripe_price_id": stripe_data["price_id"],
-                    }
-                )
+                return {
+                    "product_id": product.id,
+                    "stripe_product_id": stripe_data["product_id"],
+                    "stripe_price_id": stripe_data["price_id"],
+                }
 
-                # Add delay to avoid rate limits
-                await asyncio.sleep(0.1)
+        results = await asyncio.gather(
+            *(sync_product(product) for product in products), return_exceptions=True
+        )
 
-            except Exception as e:
-                errors.append({"product_id": product.id, "error": str(e)})
+        synced_products = []
+        errors = []
+        for product, result in zip(products, results):
+            if isinstance(result, Exception):
+                errors.append({"product_id": product.id, "error": str(result)})
+            else:
+                synced_products.append(result)
 
         return {
             "synced_count": len(synced_products),
@@ -241,22 +510,41 @@ class PaymentGatewayService:
     # ==================== PAYPAL INTEGRATION ====================
 
     async def get_paypal_access_token(self) -> str:
-        """Get PayPal access token"""
+        """Get PayPal access token, reusing the cached one until it expires"""
+        if self._paypal_token and time.monotonic() < self._paypal_token_expires_at:
+            return self._paypal_token
+
         try:
-            async with httpx.AsyncClient() as client:
+            async with self._paypal_token_lock:
+                # Another request may have refreshed the token while we waited
+                if (
+                    self._paypal_token
+                    and time.monotonic() < self._paypal_token_expires_at
+                ):
+                    return self._paypal_token
+
+                client = self._get_client()
                 response = await client.post(
                     f"{self.paypal_base_url}/v1/oauth2/token",
-                    auth=(self.paypal_client_id, self.paypal_secret),
-                    headers={"Accept": "application/json"},
+                    headers=self._paypal_token_headers,
                     data={"grant_type": "client_credentials"},
                 )
                 response.raise_for_status()
-                return response.json()["access_token"]
+                token_data = orjson.loads(response.content)
+
+                self._paypal_token = token_data["access_token"]
+                self._paypal_token_expires_at = (
+                    time.monotonic()
+                    + token_data.get("expires_in", 0)
+                    - TOKEN_EXPIRY_MARGIN
+                )
+                return self._paypal_token
 
         except Exception as e:
+            logger.error(f"Failed to get PayPal token: {e}", exc_info=True)
             raise HTTPException(
                 status_code=status.HTTP_400_BAD_REQUEST,
-                detail=f"Failed to get PayPal token: {str(e)}",
+                detail="Failed to get PayPal token",
             )
 
     async def create_paypal_order(self, order: Order) -> Dict[str, Any]:
@@ -264,24 +552,19 @@ class PaymentGatewayService:
         try:
             access_token = await self.get_paypal_access_token()
 
-            # Calculate total
-            total_amount = sum(item.price * item.quantity for item in order.items)
+            order_items, total = _order_line_items(order)
+            total_amount = f"{total:.2f}"
 
-            # Prepare order items
-            items = []
-            for item in order.items:
-                items.append(
-                    {
-                        "name": item.product_name,
-                        "description": f"License: {item.license_type}",
-                        "unit_amount": {
-                            "currency_code": "SAR",
-                            "value": str(item.price),
-                        },
-                        "quantity": str(item.quantity),
-                        "category": "DIGITAL_GOODS",
-                    }
-                )
+            items = [
+                {
+                    "name": item["name"],
+                    "description": item["description"],
+                    "unit_amount": {"currency_code": "SAR", "value": item["price"]},
+                    "quantity": str(item["quantity"]),
+                    "category": "DIGITAL_GOODS",
+                }
+                for item in order_items
+            ]
 
             paypal_order = {
                 "intent": "CAPTURE",
@@ -290,11 +573,11 @@ class PaymentGatewayService:
                         "reference_id": str(order.id),
                         "amount": {
                             "currency_code": "SAR",
-                            "value": str(total_amount),
+                            "value": total_amount,
                             "breakdown": {
                                 "item_total": {
                                     "currency_code": "SAR",
-                                    "value": str(total_amount),
+                                    "value": total_amount,
                                 }
                             },
                         },
@@ -304,31 +587,27 @@ class PaymentGatewayService:
                         "soft_descriptor": "BRAINSAIT",
                     }
                 ],
-                "application_context": {
-                    "brand_name": "BrainSAIT Solutions",
-                    "landing_page": "BILLING",
-                    "user_action": "PAY_NOW",
-                    "return_url": f"{settings.FRONTEND_URL}/payment/success",
-                    "cancel_url": f"{settings.FRONTEND_URL}/payment/cancel",
-                },
+                "application_context": PAYPAL_APPLICATION_CONTEXT,
             }
 
-            async with httpx.AsyncClient() as client:
-                response = await client.post(
-                    f"{self.paypal_base_url}/v2/checkout/orders",
-                    headers={
-                        "Authorization": f"Bearer {access_token}",
-                        "Content-Type": "application/json",
-                    },
-                    json=paypal_order,
-                )
-                response.raise_for_status()
-                return response.json()
+            client = self._get_client()
+            response = await client.post(
+                f"{self.paypal_base_url}/v2/checkout/orders",
+                headers={
+                    "Authorization": f"Bearer {access_token}",
+                    "Content-Type": "application/json",
+                    "PayPal-Request-Id": f"order-{order.id}",
+                },
+                content=orjson.dumps(paypal_order),
+            )
+            response.raise_for_status()
+            return orjson.loads(response.content)
 
         except Exception as e:
+            logger.error(f"Failed to create PayPal order: {e}", exc_info=True)
             raise HTTPException(
                 status_code=status.HTTP_400_BAD_REQUEST,
-                detail=f"Failed to create PayPal order: {str(e)}",
+                detail="Failed to create PayPal order",
             )
 
     async def capture_paypal_payment(self, order_id: str) -> Dict[str, Any]:
@@ -336,21 +615,23 @@ class PaymentGatewayService:
         try:
             access_token = await self.get_paypal_access_token()
 
-            async with httpx.AsyncClient() as client:
-                response = await client.post(
-                    f"{self.paypal_base_url}/v2/checkout/orders/{order_id}/capture",
-                    headers={
-                        "Authorization": f"Bearer {access_token}",
-                        "Content-Type": "application/json",
-                    },
-                )
-                response.raise_for_status()
-                return response.json()
+            client = self._get_client()
+            response = await client.post(
+                f"{self.paypal_base_url}/v2/checkout/orders/{order_id}/capture",
+                headers={
+                    "Authorization": f"Bearer {access_token}",
+                    "Content-Type": "application/json",
+                    "PayPal-Request-Id": f"capture-{order_id}",
+                },
+            )
+            response.raise_for_status()
+            return orjson.loads(response.content)
 
         except Exception as e:
+            logger.error(f"Failed to capture PayPal payment: {e}", exc_info=True)
             raise HTTPException(
                 status_code=status.HTTP_400_BAD_REQUEST,
-                detail=f"Failed to capture PayPal payment: {str(e)}",
+                detail="Failed to capture PayPal payment",
             )
 
     # ==================== APPLE PAY INTEGRATION ====================
@@ -366,22 +647,20 @@ class PaymentGatewayService:
                 "displayName": "BrainSAIT Solutions",
             }
 
-            async with httpx.AsyncClient(
-                cert=(settings.APPLE_PAY_CERT_PATH, settings.APPLE_PAY_KEY_PATH),
-                verify=settings.APPLE_PAY_CA_PATH,
-            ) as client:
-                response = await client.post(
-                    validation_url,
-                    json=validation_data,
-                    headers={"Content-Type": "application/json"},
-                )
-                response.raise_for_status()
-                return response.json()
+            client = self._get_apple_pay_client()
+            response = await client.post(
+                validation_url,
+                content=orjson.dumps(validation_data),
+                headers={"Content-Type": "application/json"},
+            )
+            response.raise_for_status()
+            return orjson.loads(response.content)
 
         except Exception as e:
+            logger.error(f"Failed to validate Apple Pay merchant: {e}", exc_info=True)
             raise HTTPException(
                 status_code=status.HTTP_400_BAD_REQUEST,
-                detail=f"Failed to validate Apple Pay merchant: {str(e)}",
+                detail="Failed to validate Apple Pay merchant",
             )
 
     async def process_apple_pay_payment(
@@ -390,16 +669,24 @@ class PaymentGatewayService:
         """Process Apple Pay payment through Stripe"""
         try:
             # Use Stripe to process Apple Pay token
-            payment_intent = self.stripe.PaymentIntent.create(
-                amount=int(order.total_amount * 100),
-                currency="sar",
-                payment_method_data={
+            intent_params = {
+                "amount": _to_minor_units(order.total_amount),
+                "currency": "sar",
+                "payment_method_data": {
                     "type": "card",
                     "card": {"token": payment_token["paymentData"]["data"]},
                 },
-                metadata={"order_id": str(order.id), "payment_method": "apple_pay"},
-                confirm=True,
-                return_url=f"{settings.FRONTEND_URL}/payment/success",
+                "metadata": {"order_id": str(order.id), "payment_method": "apple_pay"},
+                "confirm": True,
+                "return_url": f"{settings.FRONTEND_URL}/payment/success",
+            }
+            # A retry with another card carries a new token and so a new key
+            payment_intent = await self._stripe_call(
+                self.stripe.PaymentIntent.create,
+                **intent_params,
+                idempotency_key=_idempotency_key(
+                    f"order-{order.id}-apple-pay", intent_params
+                ),
             )
 
             return {
@@ -409,9 +696,10 @@ class PaymentGatewayService:
             }
 
         except Exception as e:
+            logger.error(f"Failed to process Apple Pay payment: {e}", exc_info=True)
             raise HTTPException(
                 status_code=status.HTTP_400_BAD_REQUEST,
-                detail=f"Failed to process Apple Pay payment: {str(e)}",
+                detail="Failed to process Apple Pay payment",
             )
 
     # ==================== SAUDI LOCAL GATEWAYS ====================
@@ -420,7 +708,7 @@ class PaymentGatewayService:
         """Create Moyasar payment for local Saudi market"""
         try:
             payment_data = {
-                "amount": int(order.total_amount * 100),  # Convert to halalas
+                "amount": _to_minor_units(order.total_amount),
                 "currency": "SAR",
                 "description": f"BrainSAIT Order #{order.id}",
                 "publishable_api_key": settings.MOYASAR_PUBLISHABLE_KEY,
@@ -428,22 +716,23 @@ class PaymentGatewayService:
                 "metadata": {"order_id": str(order.id), "user_id": str(order.user_id)},
             }
 
-            async with httpx.AsyncClient() as client:
-                response = await client.post(
-                    "https://api.moyasar.com/v1/payments",
-                    headers={
-                        "Authorization": f"Basic {settings.MOYASAR_SECRET_KEY}",
-                        "Content-Type": "application/json",
-                    },
-                    json=payment_data,
-                )
-                response.raise_for_status()
-                return response.json()
+            client = self._get_client()
+            response = await client.post(
+                "https://api.moyasar.com/v1/payments",
+                headers={
+                    "Authorization": self._moyasar_auth_header,
+                    "Content-Type": "application/json",
+                },
+                content=orjson.dumps(payment_data),
+            )
+            response.raise_for_status()
+            return orjson.loads(response.content)
 
         except Exception as e:
+            logger.error(f"Failed to create Moyasar payment: {e}", exc_info=True)
             raise HTTPException(
                 status_code=status.HTTP_400_BAD_REQUEST,
-                detail=f"Failed to create Moyasar payment: {str(e)}",
+                detail="Failed to create Moyasar payment",
             )
 
     async def create_hyperpay_checkout(self, order: Order) -> Dict[str, Any]:
@@ -460,66 +749,112 @@ class PaymentGatewayService:
                 "customParameters[order_id]": str(order.id),
             }
 
-            async with httpx.AsyncClient() as client:
-                response = await client.post(
-                    f"{settings.HYPERPAY_BASE_URL}/v1/checkouts",
-                    headers={
-                        "Authorization": f"Bearer {settings.HYPERPAY_ACCESS_TOKEN}",
-                        "Content-Type": "application/x-www-form-urlencoded",
-                    },
-                    data=checkout_data,
-                )
-                response.raise_for_status()
-                return response.json()
+            client = self._get_client()
+            response = await client.post(
+                f"{settings.HYPERPAY_BASE_URL}/v1/checkouts",
+                headers={
+                    "Authorization": f"Bearer {settings.HYPERPAY_ACCESS_TOKEN}",
+                    "Content-Type": "application/x-www-form-urlencoded",
+                },
+                data=checkout_data,
+            )
+            response.raise_for_status()
+            return orjson.loads(response.content)
 
         except Exception as e:
+            logger.error(f"Failed to create HyperPay checkout: {e}", exc_info=True)
             raise HTTPException(
                 status_code=status.HTTP_400_BAD_REQUEST,
-                detail=f"Failed to create HyperPay checkout: {str(e)}",
+                detail="Failed to create HyperPay checkout",
             )
 
     # ==================== UNIFIED PAYMENT PROCESSING ====================
 
-    async def process_payment(
-        self, order: Order, payment_method: str, payment_data: Dict[str, Any] = None
-    ) -> Dict[str, Any]:
-        """Process payment through specified gateway"""
+    async def get_order_for_payment(
+        self, db: AsyncSession, order_id: Any
+    ) -> Optional[Order]:
+        """Load an order with its items eagerly loaded for payment serialization"""
+        return await db.get(Order, order_id, options=[selectinload(Order.items)])
+
+    @asynccontextmanager
+    async def _payment_slot(self, user_id: Any, gateway: str) -> AsyncIterator[None]:
+        """Limit how many payment attempts a user can have in flight per gateway"""
+        key = f"payments:inflight:{user_id}:{gateway}"
+        request_id = secrets.token_hex(8)
+        redis = cache_manager.redis_client
 
         try:
-            if payment_method == "stripe":
-                return await self.create_stripe_checkout_session(
-                    order,
-                    payment_data.get(
-                        "success_url", f"{settings.FRONTEND_URL}/payment/success"
-                    ),
-                    payment_data.get(
-                        "cancel_url", f"{settings.FRONTEND_URL}/payment/cancel"
-                    ),
-                )
+            acquired = await redis.eval(
+                _ACQUIRE_PAYMENT_SLOT_SCRIPT,
+                1,
+                key,
+                request_id,
+                time.time(),
+                PAYMENT_SLOT_TIMEOUT,
+                MAX_INFLIGHT_PAYMENTS_PER_USER,
+            )
+            limiter_available = True
+        except Exception as e:
+            logger.warning(f"Payment concurrency limiter unavailable: {e}")
+            limiter_available = False
 
-            elif payment_method == "paypal":
-                return await self.create_paypal_order(order)
+        # Fail open: the limiter must never take payments down with Redis. The
+        # yield sits outside the except block so payment errors are not chained
+        # to the Redis failure.
+        if not limiter_available:
+            yield
+            return
 
-            elif payment_method == "apple_pay":
-                return await self.process_apple_pay_payment(
-                    payment_data["payment_token"], order
-                )
+        if not acquired:
+            raise HTTPException(
+                status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+                detail="Too many payment attempts in progress",
+            )
 
-            elif payment_method == "moyasar":
-                return await self.create_moyasar_payment(order)
+        try:
+            yield
+        finally:
+            try:
+                await redis.zrem(key, request_id)
+            except Exception as e:
+                logger.warning(f"Failed to release payment slot {key}: {e}")
 
-            elif payment_method == "hyperpay":
-                return await self.create_hyperpay_checkout(order)
+    async def _process_stripe_payment(
+        self, order: Order, payment_data: Dict[str, Any]
+    ) -> Dict[str, Any]:
+        """Start a Stripe checkout session using the caller's redirect URLs"""
+        return await self.create_stripe_checkout_session(
+            order,
+            payment_data.get("success_url", f"{settings.FRONTEND_URL}/payment/success"),
+            payment_data.get("cancel_url", f"{settings.FRONTEND_URL}/payment/cancel"),
+        )
 
-            else:
-                raise HTTPException(
-                    status_code=status.HTTP_400_BAD_REQUEST,
-                    detail=f"Unsupported payment method: {payment_method}",
-                )
+    async def process_payment(
+        self, order: Order, payment_method: str, payment_data: Dict[str, Any] = None
+    ) -> Dict[str, Any]:
+        """Process payment through specified gateway
+
+        ``order.items`` must already be loaded (see ``get_order_for_payment``)
+        so that building gateway line items does not trigger lazy loads.
+        """
+
+        processor = self._payment_processors.get(payment_method)
+        if processor is None:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail=f"Unsupported payment method: {payment_method}",
+            )
+
+        try:
+            async with self._payment_slot(order.user_id, payment_method):
+                return await processor(order, payment_data or {})
 
         except Exception as e:
-            # Log error for monitoring
-            print(f"Payment processing error: {e}")
+            logger.error(
+                f"Payment processing error for order {order.id} "
+                f"via {payment_method}: {e}",
+                exc_info=True,
+            )
             raise
 
     async def verify_webhook_signature(
@@ -528,14 +863,30 @@ class PaymentGatewayService:
         """Verify webhook signature for security"""
 
         if gateway == "stripe":
+            cache_key = VerifiedSignatureCache.make_key(payload, signature)
+            if cache_key in self._verified_signatures:
+                return True
+
             try:
-                self.stripe.Webhook.construct_event(
-                    payload, signature, settings.STRIPE_WEBHOOK_SECRET
+                await asyncio.to_thread(
+                    self.stripe.Webhook.construct_event,
+                    payload,
+                    signature,
+                    settings.STRIPE_WEBHOOK_SECRET,
+                    tolerance=WEBHOOK_SIGNATURE_TOLERANCE,
                 )
-                return True
-            except:
+            except (ValueError, stripe.error.SignatureVerificationError):
                 return False
 
+            signed_at = _stripe_signature_timestamp(signature)
+            if signed_at is None:
+                return True
+
+            self._verified_signatures.add(
+                cache_key, signed_at + WEBHOOK_SIGNATURE_TOLERANCE
+            )
+            return True
+
         elif gateway == "paypal":
             # Implement PayPal webhook verification
             # This requires PayPal webhook certificate verification
@@ -544,100 +895,128 @@ class PaymentGatewayService:
         return False
 
     async def handle_payment_webhook(
-        self, gateway: str, event_data: Dict[str, Any], db: Session
+        self, gateway: str, event_data: Dict[str, Any], db: AsyncSession
     ) -> Dict[str, Any]:
-        """Handle payment gateway webhooks"""
+        """Handle payment gateway webhooks
 
-        if gateway == "stripe":
-            return await self._handle_stripe_webhook(event_data, db)
-        elif gateway == "paypal":
-            return await self._handle_paypal_webhook(event_data, db)
-        elif gateway == "moyasar":
-            return await self._handle_moyasar_webhook(event_data, db)
-        elif gateway == "hyperpay":
-            return await self._handle_hyperpay_webhook(event_data, db)
+        Events are applied before the response is sent. A failure propagates so
+        the endpoint answers with an error and the gateway redelivers the event.
+        """
 
-    async def _handle_stripe_webhook(self, event: Dict[str, Any], db: Session):
+        handler = self._webhook_handlers.get(gateway)
+        if handler is None:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail=f"Unsupported payment gateway: {gateway}",
+            )
+
+        # Gateways deliver at least once; skip events we have already handled
+        event_id = event_data.get("id")
+        dedup_key = f"webhook:{gateway}:{event_id}" if event_id else None
+        if dedup_key and not await cache_manager.set_if_absent(
+            dedup_key, WEBHOOK_DEDUP_TTL
+        ):
+            return {"status": "duplicate"}
+
+        try:
+            return await handler(event_data, db)
+        except Exception:
+            # Release the event so the gateway's retry of this delivery is handled
+            if dedup_key:
+                await self._release_webhook_claim(dedup_key)
+            raise
+
+    async def _release_webhook_claim(self, dedup_key: str) -> None:
+        """Forget a claimed webhook event ID so it can be processed again"""
+        try:
+            await cache_manager.redis_client.delete(dedup_key)
+        except Exception as e:
+            logger.warning(f"Failed to release webhook claim {dedup_key}: {e}")
+
+    async def _mark_order_paid(
+        self,
+        db: AsyncSession,
+        order_id: str,
+        payment_reference: str,
+        payment_method: Optional[str] = None,
+    ) -> bool:
+        """Mark an order as paid in a single UPDATE; returns False if not found"""
+        values = {
+            "payment_status": PaymentStatus.PAID,
+            "payment_reference": payment_reference,
+        }
+        if payment_method is not None:
+            values["payment_method"] = payment_method
+
+        result = await db.execute(
+            update(Order)
+            .where(Order.id == order_id)
+            .values(**values)
+            .returning(Order.id)
+        )
+        updated = result.scalar_one_or_none() is not None
+        await db.commit()
+        return updated
+
+    async def _handle_stripe_webhook(self, event: Dict[str, Any], db: AsyncSession):
         """Handle Stripe webhook events"""
 
         if event["type"] == "checkout.session.completed":
             session = event["data"]["object"]
-            order_id = session["metadata"]["order_id"]
-
-            # Update order status
-            order = db.query(Order).filter(Order.id == order_id).first()
-            if order:
-                order.status = OrderStatus.PAID
-                order.payment_method = PaymentMethod.STRIPE
-                order.payment_reference = session["id"]
-                order.paid_at = datetime.utcnow()
-                db.commit()
+            await self._mark_order_paid(
+                db,
+                session["metadata"]["order_id"],
+                session["id"],
+                PaymentMethod.STRIPE,
+            )
 
         elif event["type"] == "payment_intent.succeeded":
             payment_intent = event["data"]["object"]
-            order_id = payment_intent["metadata"]["order_id"]
-
-            # Update order status
-            order = db.query(Order).filter(Order.id == order_id).first()
-            if order:
-                order.status = OrderStatus.PAID
-                order.payment_reference = payment_intent["id"]
-                order.paid_at = datetime.utcnow()
-                db.commit()
+            await self._mark_order_paid(
+                db, payment_intent["metadata"]["order_id"], payment_intent["id"]
+            )
 
         return {"status": "handled"}
 
-    async def _handle_paypal_webhook(self, event: Dict[str, Any], db: Session):
+    async def _handle_paypal_webhook(self, event: Dict[str, Any], db: AsyncSession):
         """Handle PayPal webhook events"""
 
         if event["event_type"] == "CHECKOUT.ORDER.APPROVED":
             order_data = event["resource"]
-            order_id = order_data["purchase_units"][0]["custom_id"]
-
-            # Update order status
-            order = db.query(Order).filter(Order.id == order_id).first()
-            if order:
-                order.status = OrderStatus.PAID
-                order.payment_method = PaymentMethod.PAYPAL
-                order.payment_reference = order_data["id"]
-                order.paid_at = datetime.utcnow()
-                db.commit()
+            await self._mark_order_paid(
+                db,
+                order_data["purchase_units"][0]["custom_id"],
+                order_data["id"],
+                PaymentMethod.PAYPAL,
+            )
 
         return {"status": "handled"}
 
-    async def _handle_moyasar_webhook(self, event: Dict[str, Any], db: Session):
+    async def _handle_moyasar_webhook(self, event: Dict[str, Any], db: AsyncSession):
         """Handle Moyasar webhook events"""
 
         if event["type"] == "payment_paid":
             payment = event["data"]
-            order_id = payment["metadata"]["order_id"]
-
-            # Update order status
-            order = db.query(Order).filter(Order.id == order_id).first()
-            if order:
-                order.status = OrderStatus.PAID
-                order.payment_method = PaymentMethod.MOYASAR
-                order.payment_reference = payment["id"]
-                order.paid_at = datetime.utcnow()
-                db.commit()
+            await self._mark_order_paid(
+                db,
+                payment["metadata"]["order_id"],
+                payment["id"],
+                PaymentMethod.MOYASAR,
+            )
 
         return {"status": "handled"}
 
-    async def _handle_hyperpay_webhook(self, event: Dict[str, Any], db: Session):
+    async def _handle_hyperpay_webhook(self, event: Dict[str, Any], db: AsyncSession):
         """Handle HyperPay webhook events"""
 
         if event["type"] == "payment.success":
             payment = event["data"]
-            order_id = payment["merchantTransactionId"]
-
-            # Update order status
-            order = db.query(Order).filter(Order.id == order_id).first()
-            if order:
-                order.status = OrderStatus.PAID
-                order.payment_method = PaymentMethod.HYPERPAY
-                order.payment_reference = payment["id"]
-                order.paid_at = datetime.utcnow()
-                db.commit()
+            await self._mark_order_paid(
+                db,
+                payment["merchantTransactionId"],
+                payment["id"],
+                PaymentMethod.HYPERPAY,
+            )
 
         return {"status": "handled"}
 
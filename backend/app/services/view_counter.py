@@ -0,0 +1,87 @@
+"""
+Buffered product view counting
+Views are counted in Redis and written to the database in periodic batches
+"""
+
+import asyncio
+import logging
+from typing import Dict
+from uuid import UUID
+
+from sqlalchemy import case, update
+
+from app.core.cache import cache_manager
+from app.core.database import get_db_session
+from app.models.products import Product
+
+logger = logging.getLogger(__name__)
+
+PENDING_VIEWS_KEY = "pending_views"
+VIEW_COUNT_FLUSH_INTERVAL = 10  # seconds
+
+# Read and clear the pending hash in one step so no increment is lost
+_TAKE_PENDING_VIEWS_SCRIPT = """
+local views = redis.call('HGETALL', KEYS[1])
+redis.call('DEL', KEYS[1])
+return views
+"""
+
+
+async def record_product_view(product_id: UUID) -> None:
+    """Count a product view without touching the database"""
+    try:
+        await cache_manager.redis_client.hincrby(
+            PENDING_VIEWS_KEY, str(product_id), 1
+        )
+    except Exception as e:
+        logger.error(f"Failed to record view for product {product_id}: {e}")
+
+
+async def flush_view_counts() -> int:
+    """Apply buffered views with a single UPDATE; returns the products updated"""
+    redis = cache_manager.redis_client
+    raw = await redis.eval(_TAKE_PENDING_VIEWS_SCRIPT, 1, PENDING_VIEWS_KEY)
+    if not raw:
+        return 0
+
+    pending: Dict[str, int] = {
+        product_id: int(count) for product_id, count in zip(raw[::2], raw[1::2])
+    }
+    deltas = {UUID(product_id): count for product_id, count in pending.items()}
+
+    try:
+        async with get_db_session() as db:
+            await db.execute(
+                update(Product)
+                .where(Product.id.in_(deltas))
+                .values(
+                    view_count=Product.view_count + case(deltas, value=Product.id)
+                )
+                .execution_options(synchronize_session=False)
+            )
+    except Exception:
+        # Put the views back so the next flush retries them
+        pipeline = redis.pipeline()
+        for product_id, count in pending.items():
+            pipeline.hincrby(PENDING_VIEWS_KEY, product_id, count)
+        await pipeline.execute()
+        raise
+
+    return len(deltas)
+
+
+async def run_view_count_flusher() -> None:
+    """Flush buffered views every VIEW_COUNT_FLUSH_INTERVAL seconds"""
+    try:
+        while True:
+            await asyncio.sleep(VIEW_COUNT_FLUSH_INTERVAL)
+            try:
+                await flush_view_counts()
+            except Exception as e:
+                logger.error(f"Failed to flush product view counts: {e}")
+    finally:
+        # Write out whatever is left when the task is cancelled on shutdown
+        try:
+            await flush_view_counts()
+        except Exception as e:
+            logger.error(f"Failed to flush product view counts: {e}")
@@ -2,15 +2,23 @@
 Tests for payment gateway service.
 """
 
+import time
 import uuid
 from decimal import Decimal
+from types import SimpleNamespace
 from unittest.mock import AsyncMock, Mock, patch
 
+import orjson
 import pytest
+import stripe
 from httpx import Response
 
-from app.models.orders import Order, OrderStatus
-from app.services.payment_gateway import PaymentGatewayService
+from app.models.orders import OrderStatus
+from app.services.payment_gateway import (
+    PaymentGatewayService,
+    _idempotency_key,
+    _to_minor_units,
+)
 
 
 class TestPaymentGatewayService:
@@ -24,8 +32,11 @@ class TestPaymentGatewayService:
     @pytest.fixture
     def mock_order(self):
         """Create mock order for testing."""
-        return Order(
+        # Plain attributes stand in for the ORM model; the service only reads them
+        return SimpleNamespace(
             id=uuid.uuid4(),
+            user_id=uuid.uuid4(),
+            items=[],
             order_number="TEST-001",
             total_amount=Decimal("1000.00"),
             currency="SAR",
@@ -60,6 +71,21 @@ class TestPaymentGatewayService:
                 payment_data["cancel_url"]
             )
 
+    @pytest.mark.asyncio
+    async def test_process_payment_uses_overridden_stripe_processor(
+        self, payment_service, mock_order
+    ):
+        """Test dispatch looks the Stripe processor up at call time."""
+        with patch.object(
+            payment_service, '_process_stripe_payment', new=AsyncMock()
+        ) as mock_processor:
+            mock_processor.return_value = {"checkout_url": "https://stripe.test"}
+
+            result = await payment_service.process_payment(mock_order, "stripe")
+
+            assert result["checkout_url"] == "https://stripe.test"
+            mock_processor.assert_awaited_once_with(mock_order, {})
+
     @pytest.mark.asyncio
     async def test_process_payment_paypal_success(self, payment_service, mock_order):
         """Test successful PayPal payment processing."""
@@ -134,6 +160,26 @@ class TestPaymentGatewayService:
             assert "redirect_url" in result
             mock_hyperpay.assert_called_once_with(mock_order)
 
+    @pytest.mark.asyncio
+    async def test_payment_slot_fails_open_without_chaining_errors(
+        self, payment_service, mock_order
+    ):
+        """Test payment errors are not chained to a Redis outage."""
+        with patch(
+            "app.services.payment_gateway.cache_manager"
+        ) as mock_cache, patch.object(
+            payment_service, 'create_paypal_order'
+        ) as mock_paypal:
+            mock_cache.redis_client.eval = AsyncMock(
+                side_effect=ConnectionError("Redis is down")
+            )
+            mock_paypal.side_effect = ValueError("Gateway declined")
+
+            with pytest.raises(ValueError) as exc_info:
+                await payment_service.process_payment(mock_order, "paypal")
+
+            assert exc_info.value.__context__ is None
+
     @pytest.mark.asyncio
     async def test_process_payment_unsupported_method(self, payment_service, mock_order):
         """Test processing payment with unsupported method."""
@@ -144,22 +190,89 @@ class TestPaymentGatewayService:
         
         assert "Unsupported payment method" in str(exc_info.value)
 
+    @pytest.mark.asyncio
+    async def test_apple_pay_retry_with_new_token_uses_new_idempotency_key(
+        self, payment_service, mock_order
+    ):
+        """Test a declined Apple Pay payment can be retried with another card."""
+        mock_order.total_amount = Decimal("1000.00")
+        intent = SimpleNamespace(
+            id="pi_test_123", status="succeeded", client_secret="secret"
+        )
+
+        with patch.object(
+            payment_service, '_stripe_call', new=AsyncMock(return_value=intent)
+        ) as mock_call:
+            for token in ("card_one", "card_two", "card_two"):
+                await payment_service.process_apple_pay_payment(
+                    {"paymentData": {"data": token}}, mock_order
+                )
+
+        keys = [call.kwargs["idempotency_key"] for call in mock_call.call_args_list]
+        assert keys[0] != keys[1]
+        assert keys[1] == keys[2]
+        assert all(key.startswith(f"order-{mock_order.id}-apple-pay-") for key in keys)
+
+    @pytest.mark.asyncio
+    async def test_checkout_attempts_use_distinct_idempotency_keys(
+        self, payment_service, mock_order
+    ):
+        """Test repeated checkouts for one order do not reuse a Stripe key."""
+        session = SimpleNamespace(id="cs_test_123", url="https://checkout.stripe.com")
+
+        with patch.object(
+            payment_service, '_stripe_call', new=AsyncMock(return_value=session)
+        ) as mock_call:
+            for _ in range(2):
+                await payment_service.create_stripe_checkout_session(
+                    mock_order, "https://example.com/ok", "https://example.com/no"
+                )
+
+        keys = {call.kwargs["idempotency_key"] for call in mock_call.call_args_list}
+        assert len(keys) == 2
+
+    @pytest.mark.parametrize(
+        "amount, halalas",
+        [
+            (Decimal("1000.00"), 100000),
+            (19.99, 1999),  # 19.99 * 100 is 1998.999... as a float
+            (0.29, 29),
+            ("10.125", 1013),  # half rounds up
+            (Decimal("0.004"), 0),
+            (5, 500),
+        ],
+    )
+    def test_to_minor_units(self, amount, halalas):
+        """Test SAR amounts convert to halalas without float truncation."""
+        assert _to_minor_units(amount) == halalas
+
+    def test_idempotency_key_tracks_request_parameters(self):
+        """Test idempotency keys are stable per request and change with it."""
+        params = {"name": "Product", "unit_amount": 1000}
+
+        assert _idempotency_key("product-1", params) == _idempotency_key(
+            "product-1", dict(params)
+        )
+        assert _idempotency_key("product-1", params) != _idempotency_key(
+            "product-1", {**params, "unit_amount": 1200}
+        )
+
     @pytest.mark.asyncio
     async def test_validate_apple_pay_merchant_success(self, payment_service):
         """Test successful Apple Pay merchant validation."""
         validation_url = "https://apple-pay-gateway.apple.com/paymentservices/startSession"
         
         mock_response = Mock()
-        mock_response.json.return_value = {
+        mock_response.content = orjson.dumps({
             "epochTimestamp": 1234567890,
             "expiresAt": 1234567890,
             "merchantSessionIdentifier": "test_session"
-        }
+        })
         mock_response.raise_for_status.return_value = None
 
-        with patch('httpx.AsyncClient') as mock_client:
+        with patch.object(payment_service, '_get_apple_pay_client') as mock_client:
             mock_client_instance = AsyncMock()
-            mock_client.return_value.__aenter__.return_value = mock_client_instance
+            mock_client.return_value = mock_client_instance
             mock_client_instance.post.return_value = mock_response
 
             result = await payment_service.validate_apple_pay_merchant(validation_url)
@@ -172,9 +285,9 @@ class TestPaymentGatewayService:
         """Test Apple Pay merchant validation failure."""
         validation_url = "https://apple-pay-gateway.apple.com/paymentservices/startSession"
         
-        with patch('httpx.AsyncClient') as mock_client:
+        with patch.object(payment_service, '_get_apple_pay_client') as mock_client:
             mock_client_instance = AsyncMock()
-            mock_client.return_value.__aenter__.return_value = mock_client_instance
+            mock_client.return_value = mock_client_instance
             mock_client_instance.post.side_effect = Exception("Network error")
 
             with pytest.raises(Exception) as exc_info:
@@ -204,7 +317,9 @@ class TestPaymentGatewayService:
         signature = "invalid_signature"
         
         with patch('stripe.Webhook.construct_event') as mock_construct:
-            mock_construct.side_effect = Exception("Invalid signature")
+            mock_construct.side_effect = stripe.error.SignatureVerificationError(
+                "Invalid signature", signature
+            )
             
             result = await payment_service.verify_webhook_signature(
                 payload, signature, "stripe"
@@ -212,6 +327,37 @@ class TestPaymentGatewayService:
             
             assert result is False
 
+    @pytest.mark.asyncio
+    async def test_verify_webhook_signature_cache_ends_at_signed_tolerance(
+        self, payment_service
+    ):
+        """Test a cached verification expires with Stripe's signed timestamp."""
+        payload = b'{"test": "data"}'
+        signed_at = int(time.time()) - 299
+        signature = f"t={signed_at},v1=abc"
+
+        with patch('stripe.Webhook.construct_event') as mock_construct:
+            assert await payment_service.verify_webhook_signature(
+                payload, signature, "stripe"
+            )
+            assert await payment_service.verify_webhook_signature(
+                payload, signature, "stripe"
+            )
+            assert mock_construct.call_count == 1
+
+            # Past the tolerance the cache no longer vouches for the delivery
+            mock_construct.side_effect = stripe.error.SignatureVerificationError(
+                "Timestamp outside the tolerance zone", signature
+            )
+            with patch(
+                "app.services.payment_gateway.time.time",
+                return_value=signed_at + 301,
+            ):
+                assert not await payment_service.verify_webhook_signature(
+                    payload, signature, "stripe"
+                )
+            assert mock_construct.call_count == 2
+
     @pytest.mark.asyncio
     async def test_handle_payment_webhook_stripe_success(self, payment_service):
         """Test handling successful Stripe webhook."""
@@ -263,6 +409,51 @@ class TestPaymentGatewayService:
             assert result["status"] == "processed"
             mock_handler.assert_called_once_with(event_data, mock_db)
 
+    @pytest.mark.asyncio
+    async def test_handle_payment_webhook_releases_claim_on_failure(
+        self, payment_service
+    ):
+        """Test a failed webhook releases its de-duplication claim."""
+        event_data = {"id": "evt_test_123", "type": "payment_intent.succeeded"}
+        mock_db = Mock()
+
+        with patch(
+            "app.services.payment_gateway.cache_manager"
+        ) as mock_cache, patch.object(
+            payment_service, '_handle_stripe_webhook'
+        ) as mock_handler:
+            mock_cache.set_if_absent = AsyncMock(return_value=True)
+            mock_cache.redis_client.delete = AsyncMock()
+            mock_handler.side_effect = Exception("Database unavailable")
+
+            with pytest.raises(Exception, match="Database unavailable"):
+                await payment_service.handle_payment_webhook(
+                    "stripe", event_data, mock_db
+                )
+
+            mock_cache.redis_client.delete.assert_awaited_once_with(
+                "webhook:stripe:evt_test_123"
+            )
+
+    @pytest.mark.asyncio
+    async def test_handle_payment_webhook_skips_duplicate(self, payment_service):
+        """Test an already claimed webhook event is not processed again."""
+        event_data = {"id": "evt_test_123", "type": "payment_intent.succeeded"}
+
+        with patch(
+            "app.services.payment_gateway.cache_manager"
+        ) as mock_cache, patch.object(
+            payment_service, '_handle_stripe_webhook'
+        ) as mock_handler:
+            mock_cache.set_if_absent = AsyncMock(return_value=False)
+
+            result = await payment_service.handle_payment_webhook(
+                "stripe", event_data, Mock()
+            )
+
+            assert result["status"] == "duplicate"
+            mock_handler.assert_not_called()
+
     @pytest.mark.asyncio
     async def test_handle_payment_webhook_unsupported_gateway(self, payment_service):
         """Test handling webhook for unsupported gateway."""
@@ -330,8 +521,10 @@ class TestPaymentGatewayService:
         import asyncio
         
         orders = [
-            Order(
+            SimpleNamespace(
                 id=uuid.uuid4(),
+                user_id=uuid.uuid4(),
+                items=[],
                 order_number=f"TEST-{i:03d}",
                 total_amount=Decimal("100.00"),
                 currency="SAR",
@@ -29,7 +29,7 @@ def event_loop():
     loop.close()
 
 
-@pytest.fixture(scope="session")
+@pytest_asyncio.fixture(scope="session")
 async def async_engine():
     """Create async database engine for testing."""
     engine = create_async_engine(
@@ -160,7 +160,7 @@ def authenticated_user_client(client, mock_regular_user):
 
 
 # Database cleanup fixtures
-@pytest.fixture(autouse=True)
+@pytest_asyncio.fixture(autouse=True)
 async def clean_db(async_session):
     """Clean database before each test."""
     # This runs before each test to ensure clean state
@@ -0,0 +1,95 @@
+"""
+Test cases for the approximate sliding window rate limiter.
+"""
+
+from types import SimpleNamespace
+from unittest.mock import AsyncMock, patch
+
+import fakeredis
+import pytest
+from fastapi import HTTPException
+
+from app.core import dependencies
+from app.core.dependencies import verify_rate_limit
+
+LIMIT = 10
+WINDOW = 60
+
+
+class TestVerifyRateLimit:
+    """Test verify_rate_limit against a Redis that runs the Lua script"""
+
+    @pytest.fixture(autouse=True)
+    def fake_redis(self):
+        """Point the limiter at an in-memory Redis with a small limit"""
+        redis = fakeredis.FakeAsyncRedis(decode_responses=True)
+        with patch.object(dependencies, "redis_client", redis), patch.object(
+            dependencies.settings, "RATE_LIMIT_REQUESTS", LIMIT
+        ), patch.object(dependencies.settings, "RATE_LIMIT_WINDOW", WINDOW):
+            yield redis
+
+    @pytest.fixture
+    def request_from_ip(self):
+        """Anonymous request identified by its client IP"""
+        return SimpleNamespace(
+            state=SimpleNamespace(), client=SimpleNamespace(host="203.0.113.7")
+        )
+
+    async def _send(self, request, at: float, count: int) -> int:
+        """Send requests at a fixed time; returns how many were allowed"""
+        allowed = 0
+        with patch.object(dependencies.time, "time", return_value=at):
+            for _ in range(count):
+                try:
+                    await verify_rate_limit(request)
+                    allowed += 1
+                except HTTPException as e:
+                    assert e.status_code == 429
+        return allowed
+
+    @pytest.mark.asyncio
+    async def test_limit_applies_within_a_window(self, request_from_ip):
+        """Test requests past the limit are rejected with 429"""
+        assert await self._send(request_from_ip, at=WINDOW * 100 + 5, count=15) == LIMIT
+
+    @pytest.mark.asyncio
+    async def test_previous_window_is_weighted_by_overlap(self, request_from_ip):
+        """Test the previous window counts in proportion to its overlap"""
+        start = WINDOW * 100
+        assert await self._send(request_from_ip, at=start + 50, count=LIMIT) == LIMIT
+
+        # Halfway into the next window half of the previous count still applies
+        halfway = start + WINDOW * 1.5
+        allowed = await self._send(request_from_ip, at=halfway, count=LIMIT)
+        assert allowed == LIMIT // 2
+
+    @pytest.mark.asyncio
+    async def test_counts_reset_after_two_windows(self, request_from_ip):
+        """Test traffic older than the previous window no longer counts"""
+        start = WINDOW * 100
+        assert await self._send(request_from_ip, at=start, count=LIMIT) == LIMIT
+        assert (
+            await self._send(request_from_ip, at=start + WINDOW * 2, count=LIMIT)
+            == LIMIT
+        )
+
+    @pytest.mark.asyncio
+    async def test_identifiers_are_limited_separately(self, request_from_ip):
+        """Test one client exhausting its limit does not affect another"""
+        at = WINDOW * 100
+        assert await self._send(request_from_ip, at=at, count=LIMIT) == LIMIT
+
+        other = SimpleNamespace(
+            state=SimpleNamespace(user_id="user-1"), client=request_from_ip.client
+        )
+        assert await self._send(other, at=at, count=1) == 1
+
+    @pytest.mark.asyncio
+    async def test_fails_open_when_redis_is_down(self, request_from_ip):
+        """Test requests are allowed when Redis cannot be reached"""
+        with patch.object(
+            dependencies.redis_client,
+            "eval",
+            new=AsyncMock(side_effect=ConnectionError("Redis is down")),
+        ):
+            assert await verify_rate_limit(request_from_ip) is True
@@ -0,0 +1,101 @@
+"""
+Test cases for buffered product view counting.
+"""
+
+import uuid
+from contextlib import asynccontextmanager
+from unittest.mock import AsyncMock, MagicMock, patch
+
+import fakeredis
+import pytest
+
+from app.services import view_counter
+from app.services.view_counter import (
+    PENDING_VIEWS_KEY,
+    flush_view_counts,
+    record_product_view,
+)
+
+
+class TestViewCounter:
+    """Test recording views in Redis and flushing them to the database"""
+
+    @pytest.fixture(autouse=True)
+    def fake_redis(self):
+        """Back the view buffer with an in-memory Redis"""
+        redis = fakeredis.FakeAsyncRedis(decode_responses=True)
+        with patch.object(view_counter.cache_manager, "redis_client", redis):
+            yield redis
+
+    @pytest.fixture
+    def mock_db(self):
+        """Database session handed out by get_db_session"""
+        db = MagicMock()
+        db.execute = AsyncMock()
+
+        @asynccontextmanager
+        async def session():
+            yield db
+
+        with patch.object(view_counter, "get_db_session", session):
+            yield db
+
+    @pytest.mark.asyncio
+    async def test_record_product_view_buffers_in_redis(self, fake_redis, mock_db):
+        """Test recording a view only increments the pending hash"""
+        product_id = uuid.uuid4()
+
+        await record_product_view(product_id)
+        await record_product_view(product_id)
+
+        assert await fake_redis.hgetall(PENDING_VIEWS_KEY) == {str(product_id): "2"}
+        mock_db.execute.assert_not_called()
+
+    @pytest.mark.asyncio
+    async def test_record_product_view_ignores_redis_errors(self):
+        """Test a Redis outage never fails the product page"""
+        with patch.object(
+            view_counter.cache_manager.redis_client,
+            "hincrby",
+            new=AsyncMock(side_effect=ConnectionError("Redis is down")),
+        ):
+            await record_product_view(uuid.uuid4())
+
+    @pytest.mark.asyncio
+    async def test_flush_without_pending_views(self, mock_db):
+        """Test an empty buffer does not touch the database"""
+        assert await flush_view_counts() == 0
+        mock_db.execute.assert_not_called()
+
+    @pytest.mark.asyncio
+    async def test_flush_applies_all_views_in_one_update(self, fake_redis, mock_db):
+        """Test pending views are written with a single UPDATE and cleared"""
+        first, second = uuid.uuid4(), uuid.uuid4()
+        for product_id in (first, first, first, second):
+            await record_product_view(product_id)
+
+        assert await flush_view_counts() == 2
+
+        mock_db.execute.assert_awaited_once()
+        params = mock_db.execute.await_args.args[0].compile().params
+        assert sorted(v for v in params.values() if isinstance(v, int)) == [1, 3]
+        assert await fake_redis.exists(PENDING_VIEWS_KEY) == 0
+
+    @pytest.mark.asyncio
+    async def test_flush_failure_restores_counts(self, fake_redis, mock_db):
+        """Test views taken for a failed UPDATE are put back for the next flush"""
+        product_id = uuid.uuid4()
+        for _ in range(3):
+            await record_product_view(product_id)
+
+        async def view_during_flush(statement):
+            # A view recorded while the flush is in progress must not be lost
+            await record_product_view(product_id)
+            raise ConnectionError("Database is down")
+
+        mock_db.execute.side_effect = view_during_flush
+
+        with pytest.raises(ConnectionError):
+            await flush_view_counts()
+
+        assert await fake_redis.hgetall(PENDING_VIEWS_KEY) == {str(product_id): "4"}
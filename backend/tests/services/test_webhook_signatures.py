@@ -0,0 +1,126 @@
+"""
+Test cases for Mada and STC Pay webhook signature verification.
+"""
+
+import hmac
+from unittest.mock import patch
+
+import pytest
+
+from app.core.cache import VerifiedSignatureCache
+from app.services import webhook_signatures
+from app.services.webhook_signatures import (
+    verify_mada_signature,
+    verify_stc_signature,
+)
+
+MADA_SECRET = b"mada-test-secret"
+STC_SECRET = b"stc-test-secret"
+PAYLOAD = b'{"payment_id": "pay_123", "status": "completed"}'
+
+
+def sign(secret: bytes, payload: bytes = PAYLOAD) -> str:
+    """Sign a payload the way the providers do"""
+    return hmac.new(secret, payload, "sha256").hexdigest()
+
+
+class TestWebhookSignatures:
+    """Test HMAC-SHA256 webhook signature verification"""
+
+    @pytest.fixture(autouse=True)
+    def configured_secrets(self):
+        """Configure both provider secrets with an empty verification cache"""
+        with patch.object(
+            webhook_signatures, "MADA_WEBHOOK_SECRET", MADA_SECRET
+        ), patch.object(
+            webhook_signatures, "STC_PAY_WEBHOOK_SECRET", STC_SECRET
+        ), patch.object(
+            webhook_signatures, "_verified_signatures", VerifiedSignatureCache()
+        ):
+            yield
+
+    def test_valid_signature(self):
+        """Test a correctly signed payload is accepted"""
+        assert verify_mada_signature(PAYLOAD, sign(MADA_SECRET)) is True
+        assert verify_stc_signature(PAYLOAD, sign(STC_SECRET)) is True
+
+    def test_uppercase_hex_signature(self):
+        """Test hex case does not matter since raw digests are compared"""
+        assert verify_mada_signature(PAYLOAD, sign(MADA_SECRET).upper()) is True
+
+    def test_bad_signature(self):
+        """Test a signature made with another key is rejected"""
+        assert verify_mada_signature(PAYLOAD, sign(b"wrong-secret")) is False
+        assert verify_stc_signature(PAYLOAD, sign(MADA_SECRET)) is False
+
+    def test_tampered_payload(self):
+        """Test the signature covers the raw body byte for byte"""
+        tampered = PAYLOAD.replace(b"completed", b"completed ")
+        assert verify_mada_signature(tampered, sign(MADA_SECRET)) is False
+
+    @pytest.mark.parametrize("signature", [None, "", "ab" * 31, "ab" * 33])
+    def test_missing_or_wrong_length_signature(self, signature):
+        """Test missing or wrongly sized signatures are rejected"""
+        assert verify_mada_signature(PAYLOAD, signature) is False
+        assert verify_stc_signature(PAYLOAD, signature) is False
+
+    def test_non_hex_signature(self):
+        """Test a 64 character signature that is not hex is rejected"""
+        assert verify_mada_signature(PAYLOAD, "zz" * 32) is False
+
+    def test_unconfigured_secret(self):
+        """Test nothing verifies when the provider secret is not configured"""
+        with patch.object(webhook_signatures, "MADA_WEBHOOK_SECRET", b""):
+            assert verify_mada_signature(PAYLOAD, sign(b"")) is False
+
+    def test_cache_hit_skips_hmac(self):
+        """Test a redelivered webhook is answered from the cache"""
+        signature = sign(MADA_SECRET)
+        assert verify_mada_signature(PAYLOAD, signature) is True
+
+        with patch.object(webhook_signatures.hmac, "digest") as mock_digest:
+            assert verify_mada_signature(PAYLOAD, signature) is True
+            mock_digest.assert_not_called()
+
+    def test_cache_is_per_provider(self):
+        """Test a Mada verification is not reused for STC Pay"""
+        signature = sign(MADA_SECRET)
+        assert verify_mada_signature(PAYLOAD, signature) is True
+        assert verify_stc_signature(PAYLOAD, signature) is False
+
+    def test_failures_are_not_cached(self):
+        """Test a rejected signature is checked again on the next delivery"""
+        signature = sign(b"wrong-secret")
+        assert verify_mada_signature(PAYLOAD, signature) is False
+
+        with patch.object(
+            webhook_signatures.hmac, "digest", wraps=hmac.digest
+        ) as mock_digest:
+            assert verify_mada_signature(PAYLOAD, signature) is False
+            mock_digest.assert_called_once()
+
+
+class TestVerifiedSignatureCache:
+    """Test the bounded verification cache"""
+
+    def test_entry_expires(self):
+        """Test entries stop matching once their expiry has passed"""
+        cache = VerifiedSignatureCache()
+        key = cache.make_key(PAYLOAD, "mada", "sig")
+        cache.add(key, expires_at=1_000)
+
+        with patch("app.core.cache.time.time", return_value=999):
+            assert key in cache
+        with patch("app.core.cache.time.time", return_value=1_000):
+            assert key not in cache
+
+    def test_least_recently_added_is_evicted(self):
+        """Test the cache never grows past its size"""
+        cache = VerifiedSignatureCache(maxsize=2)
+        keys = [cache.make_key(PAYLOAD, "mada", str(i)) for i in range(3)]
+        for key in keys:
+            cache.add(key, expires_at=float("inf"))
+
+        assert keys[0] not in cache
+        assert keys[1] in cache
+        assert keys[2] in cache